@@ -89,10 +89,14 @@ DeCompType: 0xff
 import os
 import re
 import sys
-import shutil
+import stat
+import time
+import errno
+import shlex
+import atexit
+import tempfile
 import argparse
 import subprocess
-from datetime import datetime
 
 # Set some variables
 # ------------------
@@ -102,12 +106,45 @@ reldate = 'August 08, 2024'
 progauthor = 'Bill Arlofski'
 authoremail = 'waa@revpol.com'
 scriptname = 'bacula-tapealert.py'
-prog_info_txt = progname + ' - v' + version + ' - ' + scriptname \
-              + ' - By: ' + progauthor + ' ' + authoremail + ' (c) ' + reldate + '\n\n'
+prog_info_txt = f'{progname} - v{version} - {scriptname} - By: {progauthor} {authoremail} (c) {reldate}\n\n'
+prog_info_sep = '-'*(len(prog_info_txt) - 2)
 
-# Local system binaries required
-# ------------------------------
-cmd_lst = ['ls', 'lsscsi', 'tapeinfo', 'uname']
+# Seconds to wait for a system utility
+# (ie: tapeinfo on a hung drive) to finish
+# ----------------------------------------
+cmd_timeout = 30
+
+# When the SD calls this script for several drives in
+# quick succession, reuse the output of 'lsscsi -g' or
+# 'camcontrol devlist' if it is less than cache_ttl
+# seconds old instead of scanning the SCSI bus again.
+# The cache_dir is created mode 0700 and is not used
+# unless it is a directory owned by the script's user
+# ----------------------------------------------------
+cache_dir = '/var/tmp/bacula-tapealert'
+cache_ttl = 5
+
+# Precompile the regular expressions used
+# to parse device names and utility outputs
+# -----------------------------------------
+st_name_re = re.compile(r'n?(st\d+)')
+sa_re = re.compile(r'/dev/n?(sa\d+)$')
+lsscsi_sg_re = re.compile(r'(/dev/sg\d+)\s*$')
+camcontrol_periph_re = re.compile(r'\(([^()]+)\)\s*$')
+
+# Log lines are buffered here and written to the
+# log file once log_buf_max bytes are buffered,
+# and again at exit
+# -----------------------------------------------
+log_buf = bytearray()
+log_buf_max = 65536
+log_fd = None
+log_failed = False
+
+# Cache for the now() timestamp string
+# ------------------------------------
+now_secs = 0
+now_txt = ''
 
 # Set the do_email variable
 # -------------------------
@@ -117,13 +154,13 @@ do_email = False
 # waa - Something to look into: https://www.reddit.com/r/Python/comments/11hqsbv/i_am_sick_of_writing_argparse_boilerplate_code_so/
 # ---------------------------------------------------------------------------------------------------------------------------------
 parser = argparse.ArgumentParser(prog=scriptname, description='Drop-in replacement for tapealert bash/perl script with more features.')
-parser.add_argument('-v', '--version', help='Print the script version.', version=scriptname + " v" + version, action='version')
+parser.add_argument('-v', '--version', help='Print the script version.', version=f'{scriptname} v{version}', action='version')
 parser.add_argument('-d', '--debug',   help='Log a lot more output, including system utility outputs.', action='store_true')
 parser.add_argument('-e', '--email',   help='Send email when TapeAlerts are detected?', default=None)
 parser.add_argument('-t', '--test',    help='Run in test mode? Edit the \'fake_tapeinfo_txt\' string in this script to suit.', action='store_true')
 parser.add_argument('-l', '--logging', help='Should the script log anything at all? Default is False!', action='store_true')
 parser.add_argument('-f', '--file',    help='Where should the script append log file to? [Default: /opt/bacula/log/bacula-tapealert.log]', \
-                    default='/opt/bacula/log/bacula-tapealert.log', type=argparse.FileType('a'))
+                    default='/opt/bacula/log/bacula-tapealert.log')
 parser.add_argument('-i', '--jobid',   help='The jobid.', default=None)
 parser.add_argument('-u', '--smtpuser', help='The SMTP user. [Default: \'\']', default='')
 parser.add_argument('-p', '--smtppass', help='The SMTP password. [Default: \'\']', default='')
@@ -135,134 +172,353 @@ args = parser.parse_args()
 # Now for some functions
 # ----------------------
 def now():
-    'Return the current date/time in human readable format.'
-    return datetime.today().strftime('%Y-%m-%d %H:%M:%S')
-
-def log(text, ftr=False):
-    'Given some text, write the text to the log_file.'
-    if debug or logging:
-        with open(log_file, 'a+') as file:
-            file.write(('\n' if text.startswith('Starting') else '') \
-                        + (now() + ' ' if not ftr else '') + ('jobid: ' + jobid \
-                        + ' ' if jobid is not None and not ftr else '') \
-                        +  ('- ' if not ftr else '| ') + text.rstrip('\n') + '\n')
+    'Return the current date/time in human readable format, reformatting it only when the second changes.'
+    global now_secs, now_txt
+    secs = int(time.time())
+    if secs != now_secs:
+        now_secs = secs
+        now_txt = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(secs))
+    return now_txt
+
+def log(fmt, *args, ftr=False):
+    'Given some text, or a %-format string and its args, write the text to the log_file.'
+    text = (fmt % args if args else fmt).rstrip('\n')
+    lf = '\n' if text.startswith('Starting') else ''
+    log_buf.extend((f'| {text}\n' if ftr else f'{lf}{now()} {jobid_prefix}- {text}\n').encode())
+    if len(log_buf) >= log_buf_max:
+        flush_log()
+
+def flush_log():
+    'Write any buffered log lines to the log_file with a single os.write() call, opening it on first use.'
+    global log_fd, log_failed
+    if log_buf and not log_failed:
+        try:
+            if log_fd is None:
+                # Create the log directory if it does not exist and
+                # open the log file only once there is something to
+                # write. The fd is opened O_APPEND so each os.write()
+                # is an atomic append, and is closed at process exit
+                # ---------------------------------------------------
+                log_dir = os.path.dirname(log_file)
+                if log_dir:
+                    os.makedirs(log_dir, exist_ok=True)
+                log_fd = os.open(log_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            os.write(log_fd, log_buf)
+        except OSError as err:
+            # Report the problem once on stderr, since stdout is
+            # read by the SD, and stop trying to write the log
+            # ---------------------------------------------------
+            print(f'{scriptname}: Cannot write to log file {log_file}: {err.strerror}', file=sys.stderr)
+            log_failed = True
+        log_buf.clear()
 
 def log_cmd_results(result):
-    'Given a subprocess.run() result object, clean up the extra line feeds from stdout and stderr and log them.'
+    'Given a run_cmd() result object, log the returncode, stdout, and stderr.'
     if debug:
-        stdout = result.stdout.rstrip('\n')
-        stderr = result.stderr.rstrip('\n')
+        stdout = result.stdout
+        stderr = result.stderr
         if stdout == '':
             stdout = 'N/A'
         if stderr == '':
             stderr = 'N/A'
-        log('returncode: ' + str(result.returncode))
-        log('stdout: ' + ('\n[begin stdout]\n' + stdout + '\n[end stdout]' if '\n' in stdout else stdout))
-        log('stderr: ' + ('\n[begin stderr]\n' + stderr + '\n[end stderr]' if '\n' in stderr else stderr))
+        log('returncode: %d', result.returncode)
+        log('stdout: %s', f'\n[begin stdout]\n{stdout}\n[end stdout]' if '\n' in stdout else stdout)
+        log('stderr: %s', f'\n[begin stderr]\n{stderr}\n[end stderr]' if '\n' in stderr else stderr)
+
+def exit_script():
+    'Log the exit message and the program info footer, then exit with return code 0.'
+    log('Exiting with return code 0')
+    log(prog_info_sep, ftr=True)
+    log(prog_info_txt, ftr=True)
+    sys.exit(0)
 
 def chk_cmd_result(result, cmd):
-    'Given a result object, check the returncode, then log and exit if non zero.'
+    'Given a result object and its command list, check the returncode, then log and exit if non zero.'
     if debug and result.returncode != 0:
-        log('ERROR calling: ' + cmd)
-        log(result.stderr.rstrip('\n'))
+        log('ERROR calling: %s', shlex.join(cmd))
+        log(result.stderr)
     if result.returncode != 0:
-        log(result.stderr.rstrip('\n'))
-        log('Exiting with return code 0')
-        log('-'*(len(prog_info_txt) - 2), ftr=True)
-        log(prog_info_txt, ftr=True)
-        sys.exit(0)
-
-def get_shell_result(cmd):
-    'Given a command to run, return the subprocess.run() result.'
-    return subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-
-def cmd_exists(cmd):
-    'Check that a binary command exists and is executable.'
-    cmd_exists = shutil.which(cmd)
-    if debug:
-        log('Checking command: ' + cmd)
-        log('Command ' + cmd + ' (' + str(cmd_exists) + '): ' + ('OK' if cmd_exists else 'FAIL'))
-    return cmd_exists
-
-def get_uname():
-    'Get the systems uname for use in tests.'
-    cmd = 'uname'
-    log('Getting system\'s uname for use in tests')
+        log(result.stderr)
+        exit_script()
+
+def start_cmd(cmd):
+    'Given a command argv list, start it without a shell and return the Popen object (or a failed result if it cannot be started).'
+    # stderr is only ever logged, so when neither debug nor
+    # logging is enabled, send it to /dev/null rather than
+    # reading and decoding it through a pipe
+    # ------------------------------------------------------
+    stderr = subprocess.PIPE if debug or logging else subprocess.DEVNULL
+    try:
+        return subprocess.Popen(cmd, shell=False, stdout=subprocess.PIPE, stderr=stderr, text=True)
+    except OSError as err:
+        # Return a failed result using the return code a shell
+        # would have given. This is how a missing or non
+        # executable tapeinfo (or lsscsi/camcontrol) is reported
+        # ------------------------------------------------------
+        if err.errno == errno.EACCES:
+            return subprocess.CompletedProcess(cmd, 126, '', f'{cmd[0]}: permission denied')
+        if err.errno == errno.ENOENT:
+            return subprocess.CompletedProcess(cmd, 127, '', f'{cmd[0]}: command not found in PATH')
+        return subprocess.CompletedProcess(cmd, 127, '', f'{cmd[0]}: {err.strerror}')
+
+def kill_cmd(proc):
+    'Given a start_cmd() result, kill the command if it is still running and reap it.'
+    if isinstance(proc, subprocess.Popen):
+        proc.kill()
+        proc.wait()
+
+def wait_cmd(proc, deadline=None):
+    'Given a start_cmd() result and an optional time.monotonic() deadline, wait for it and return a result with trailing line feeds stripped from stdout and stderr.'
+    if isinstance(proc, subprocess.CompletedProcess):
+        return proc
+    # Commands sharing a deadline only get the time that
+    # is left on it, not a new cmd_timeout each
+    # --------------------------------------------------
+    timeout = cmd_timeout if deadline is None else max(0, deadline - time.monotonic())
+    try:
+        stdout, stderr = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        # Kill the command and return a failed result so that
+        # chk_cmd_result() logs the timeout and exits like any
+        # other error
+        # ----------------------------------------------------
+        kill_cmd(proc)
+        return subprocess.CompletedProcess(proc.args, -1, '', f'{shlex.join(proc.args)} timed out after {cmd_timeout} seconds')
+    return subprocess.CompletedProcess(proc.args, proc.returncode, stdout.rstrip('\n'), (stderr or '').rstrip('\n'))
+
+def run_cmd(cmd):
+    'Given a command argv list, run it without a shell and return the wait_cmd() result.'
+    return wait_cmd(start_cmd(cmd))
+
+def chk_cache_dir():
+    'Create the cache_dir if needed and return True if it is a directory owned by our user that nobody else can write to.'
+    try:
+        os.mkdir(cache_dir, 0o700)
+    except FileExistsError:
+        pass
+    except OSError:
+        return False
+    try:
+        st = os.lstat(cache_dir)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+def read_cache(cache_file):
+    'Given a cache file, return its contents if it is a fresh regular file owned by our user, otherwise None.'
+    try:
+        # O_NOFOLLOW so a symlink is never followed, then check
+        # the file that was actually opened, not the path name
+        # ------------------------------------------------------
+        fd = os.open(cache_file, os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK)
+    except OSError:
+        return None
+    st = os.fstat(fd)
+    if not (stat.S_ISREG(st.st_mode) and st.st_uid == os.getuid() and time.time() - st.st_mtime < cache_ttl):
+        os.close(fd)
+        return None
+    try:
+        with os.fdopen(fd) as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+def write_cache(cache_file, txt):
+    'Given a cache file and some text, atomically replace the cache file with the text.'
+    # Write to a temporary file and rename it so
+    # that concurrent runs never read a partial file
+    # ----------------------------------------------
+    tmp_file = None
+    try:
+        fd, tmp_file = tempfile.mkstemp(prefix='.tmp-', dir=cache_dir)
+        with os.fdopen(fd, 'w') as f:
+            f.write(txt)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        log('Failed to write the cache file: %s', cache_file)
+        if tmp_file is not None:
+            try:
+                os.unlink(tmp_file)
+            except OSError:
+                pass
+
+def run_cached_cmd(cmd, parse, key):
+    'Given a command argv list, a parse function, and its key, return parse(output, key), using recent cached output when it contains the key.'
+    use_cache = chk_cache_dir()
+    cache_file = os.path.join(cache_dir, f'{cmd[0]}.cache')
+    if use_cache:
+        txt = read_cache(cache_file)
+        if txt is not None:
+            log('Using cached %s output from: %s', cmd[0], cache_file)
+            found = parse(txt, key)
+            if found is not None:
+                return found
+            # The cached output may be older than the drive, so
+            # rescan rather than failing on stale information
+            # -------------------------------------------------
+            log('%s not found in cached %s output, running it again', key, cmd[0])
     if debug:
-        log('shell command: ' + cmd)
-    result = get_shell_result(cmd)
+        log('%s command: %s', cmd[0], shlex.join(cmd))
+    result = run_cmd(cmd)
     log_cmd_results(result)
     chk_cmd_result(result, cmd)
-    return result.stdout.rstrip('\n')
+    if use_cache:
+        write_cache(cache_file, result.stdout)
+    return parse(result.stdout, key)
 
-def get_sg_node():
-    'Given a drive_device, return the /dev/sg# node.'
+def get_sg_node_linux():
+    'Given a Linux drive_device, return the /dev/sg# node.'
     log('Determining the tape drive device\'s sg node required by tapeinfo')
-    if uname == 'Linux':
-        cmd = 'ls -l ' + drive_device
+    if drive_device.startswith('/dev/sg'):
+        # A /dev/sg device was passed to the script, so
+        # issue a warning, skip resolving the device and
+        # trying to match it to an sg node, and just
+        # return the /dev/sg node
+        # ------------------------------------------------
+        log('NOTE: A /dev/sg node was passed to this script')
+        log('      Be aware that this may not be the correct sg node for the drive being tested')
+        log('      It is recommended to pass this script the same node set for the \'ArchiveDevice\'')
+        return drive_device
+    if not os.path.exists(drive_device):
+        log('Drive device %s does not exist', drive_device)
+        exit_script()
+    st = None
+    if drive_device.startswith(('/dev/st', '/dev/nst')):
+        # A /dev/st# or /dev/nst# case was caught
+        # ---------------------------------------
+        st_name = os.path.basename(drive_device)
+        st = f"/dev/{st_name[1:] if st_name.startswith('n') else st_name}"
+    elif '/dev/tape/by-' in drive_device:
+        # A /dev/tape/by-id or /dev/tape/by-path case was caught,
+        # so resolve the symlink in-process rather than calling
+        # 'ls -l' and parsing its output
+        # -------------------------------------------------------
+        target = os.path.realpath(drive_device)
         if debug:
-            log('ls command: ' + cmd)
-        result = get_shell_result(cmd)
-        log_cmd_results(result)
-        chk_cmd_result(result, cmd)
-        if '/dev/sg' in drive_device:
-            # A /dev/sg device was passed to the script, so
-            # issue a warning, skip trying to match it in the
-            # lsscsi -g output, and just return the /dev/sg node
-            # --------------------------------------------------
-            log('NOTE: A /dev/sg node was passed to this script')
-            log('      Be aware that this may not be the correct sg node for the drive being tested')
-            log('      It is recommended to pass this script the same node set for the \'ArchiveDevice\'')
-            return drive_device
-        elif any(x in drive_device for x in ('/dev/st', '/dev/nst')):
-            # A /dev/st# or /dev/nst# case was caught
-            # ---------------------------------------
-            st = re.sub('.*(/dev/)n(.*)', '\\1\\2', drive_device, re.S)
-        elif any(x in drive_device for x in ('/by-id', '/by-path')):
-            # A /dev/tape/by-id or /dev/tape/by-path case was caught
-            # ------------------------------------------------------
-            st = '/dev/' + re.sub('.* -> .*/n*(st\\d+).*$', '\\1', result.stdout.rstrip('\n'), re.S)
-        cmd = 'lsscsi -g'
-        if debug:
-            log('lsscsi command: ' + cmd)
-        result = get_shell_result(cmd)
-        log_cmd_results(result)
-        chk_cmd_result(result, cmd)
-        sg_search = re.search('.*' + st + ' .*(/dev/sg\\d+)', result.stdout)
-        if sg_search:
-            sg = sg_search.group(1)
-            log('sg node determined for drive device: ' + sg)
-            return sg
-    elif uname == 'FreeBSD':
-        sa = re.sub(r'/dev/(sa\d+)', '\\1', drive_device)
-        cmd = 'camcontrol devlist'
-        if debug:
-            log('camcontrol command: ' + cmd)
-        result = get_shell_result(cmd)
-        log_cmd_results(result)
-        chk_cmd_result(result, cmd)
-        sg_search = re.search('.*\\((pass\\d+),' + sa + '\\)', result.stdout)
-        if sg_search:
-            sg = '/dev/' + sg_search.group(1)
-            log('SG node for drive device: ' + drive_device + ' --> ' + sg)
+            log('Drive device resolves to: %s', target)
+        st_search = st_name_re.search(os.path.basename(target))
+        if st_search:
+            st = f'/dev/{st_search.group(1)}'
+    if st is None:
+        log('Failed to identify an st node for drive device %s', drive_device)
+        exit_script()
+    # The kernel exposes the st# to sg# mapping in sysfs, so
+    # try there first and only fall back to parsing the output
+    # of 'lsscsi -g' if the sysfs entry is missing
+    # ---------------------------------------------------------
+    sg_dir = f'/sys/class/scsi_tape/n{os.path.basename(st)}/device/scsi_generic'
+    if debug:
+        log('sysfs directory: %s', sg_dir)
+    try:
+        sg = f'/dev/{os.listdir(sg_dir)[0]}'
+        log('sg node determined for drive device: %s', sg)
+        return sg
+    except (OSError, IndexError):
+        log('sg node not found in sysfs, falling back to lsscsi')
+    sg = run_cached_cmd(['lsscsi', '-g'], parse_lsscsi, st)
+    if sg is not None:
+        log('sg node determined for drive device: %s', sg)
+        return sg
+    log('Failed to identify an sg node device for drive device %s', drive_device)
+    exit_script()
+
+def get_sg_node_freebsd():
+    'Given a FreeBSD drive_device, return the /dev/pass# node.'
+    log('Determining the tape drive device\'s sg node required by tapeinfo')
+    # Both the rewinding /dev/sa# and non-rewinding
+    # /dev/nsa# nodes map to the same sa# peripheral
+    # ----------------------------------------------
+    sa_search = sa_re.search(drive_device)
+    if sa_search:
+        sg = run_cached_cmd(['camcontrol', 'devlist'], parse_camcontrol, sa_search.group(1))
+        if sg is not None:
+            log('SG node for drive device: %s --> %s', drive_device, sg)
             return sg
-    else:
-        log('Failed to identify an sg node device for drive device ' + drive_device)
-        log('Exiting with return code 0')
-        sys.exit(0)
+    log('Failed to identify an sg node device for drive device %s', drive_device)
+    exit_script()
+
+def parse_lsscsi(txt, st):
+    'Given some \'lsscsi -g\' output and a /dev/st# node, return its /dev/sg# node or None.'
+    for line in txt.splitlines():
+        if f'{st} ' in line:
+            sg_search = lsscsi_sg_re.search(line)
+            if sg_search:
+                return sg_search.group(1)
+    return None
+
+def parse_camcontrol(txt, sa):
+    'Given some \'camcontrol devlist\' output and an sa# peripheral, return its /dev/pass# node or None.'
+    # The peripheral list at the end of each line may
+    # be in either order, ie: (pass0,sa0) or (sa0,pass0)
+    # --------------------------------------------------
+    for line in txt.splitlines():
+        periph_search = camcontrol_periph_re.search(line)
+        if periph_search:
+            periphs = periph_search.group(1).split(',')
+            if sa in periphs:
+                for periph in periphs:
+                    if periph.startswith('pass'):
+                        return f'/dev/{periph}'
+    return None
 
 def tapealerts(sg):
-    'Call tapeinfo and return any tape alerts.'
-    cmd = 'tapeinfo -f ' + sg
+    'Call tapeinfo and sg_logs and return any tape alerts.'
+    # tapeinfo does not always report a drive needing cleaning,
+    # but the Sequential Access Device log page (0x0c) read by
+    # sg_logs does. Both are started before either is waited
+    # on so that they run in parallel, and both must finish
+    # within one cmd_timeout. sg_logs is optional, so if it is
+    # missing or fails, only tapeinfo's alerts are used
+    # ----------------------------------------------------------
+    cmd = ['tapeinfo', '-f', sg]
+    sg_logs_cmd = ['sg_logs', '--page=0xc', sg]
     if debug:
-        log('tapeinfo command: ' + cmd)
-    result = get_shell_result(cmd)
+        log('tapeinfo command: %s', shlex.join(cmd))
+        log('sg_logs command: %s', shlex.join(sg_logs_cmd))
+    deadline = time.monotonic() + cmd_timeout
+    proc = start_cmd(cmd)
+    sg_logs_proc = start_cmd(sg_logs_cmd)
+    result = wait_cmd(proc, deadline)
     log_cmd_results(result)
-    chk_cmd_result(result, cmd)
-    return re.findall(r'(TapeAlert\[\d+\]): +(.*)', result.stdout)
+    if result.returncode != 0:
+        # tapeinfo failed and the script is about to
+        # exit, so do not wait for sg_logs to finish
+        # ------------------------------------------
+        kill_cmd(sg_logs_proc)
+        chk_cmd_result(result, cmd)
+    alerts = parse_tapealerts(result.stdout)
+    sg_logs_result = wait_cmd(sg_logs_proc, deadline)
+    log_cmd_results(sg_logs_result)
+    if sg_logs_result.returncode != 0:
+        if debug:
+            log('sg_logs failed, skipping the cleaning check')
+    elif 'Cleaning action required' in sg_logs_result.stdout \
+         and not any(alert[0] == 'TapeAlert[20]' for alert in alerts):
+        log('sg_logs reports cleaning action required, adding TapeAlert[20]')
+        alerts.append(('TapeAlert[20]', 'Clean Now: Cleaning action required (reported by sg_logs).'))
+    return alerts
+
+def parse_tapealerts(txt):
+    'Given some tapeinfo output, return a list of (\'TapeAlert[#]\', \'description\') tuples.'
+    alerts = []
+    for line in txt.splitlines():
+        # Cheap prefix test first, then make sure the line
+        # really is 'TapeAlert[#]: description' so that a
+        # malformed line is skipped instead of raising
+        # ------------------------------------------------
+        if line.startswith('TapeAlert['):
+            code, sep, desc = line.partition(':')
+            if sep and code.endswith(']') and code[10:-1].isdigit():
+                alerts.append((code, desc.lstrip()))
+    return alerts
 
 def send_email():
     'Send the email.'
+    # Only import the email modules when an email is actually sent
+    # ------------------------------------------------------------
+    import smtplib
+    from socket import gaierror
+
     # Thank you to Aleksandr Varnin for this short and simple to implement solution
     # https://blog.mailtrap.io/sending-emails-in-python-tutorial-with-code-examples
     # -----------------------------------------------------------------------------
@@ -273,17 +529,17 @@ def send_email():
             if smtpuser != '' and smtppass != '':
                 server.login(smtpuser, smtppass)
             server.sendmail(fromemail, email, message)
-            log('Successfully emailed TapeAlerts to: ' + email)
+            log('Successfully emailed TapeAlerts to: %s', email)
     except (gaierror, ConnectionRefusedError):
         log('Failed to connect to the SMTP server. Bad connection settings?')
-        sys.exit(0)
+        exit_script()
     except smtplib.SMTPServerDisconnected:
         log('Failed to connect to the SMTP server. Wrong user/password?')
-        sys.exit(0)
+        exit_script()
     except smtplib.SMTPException as err:
-        log('Error occurred while communicating with SMTP server ' + smtpserver + ':' + str(smtpport))
-        log('  Error was: ' + str(err))
-        sys.exit(0)
+        log('Error occurred while communicating with SMTP server %s:%s', smtpserver, smtpport)
+        log('  Error was: %s', err)
+        exit_script()
 
 # ================
 # BEGIN THE SCRIPT
@@ -293,8 +549,9 @@ def send_email():
 test = args.test
 debug = args.debug
 jobid = args.jobid
+jobid_prefix = f'jobid: {jobid} ' if jobid is not None else ''
 logging = args.logging
-log_file = args.file.name
+log_file = args.file
 email = fromemail = args.email
 drive_device = args.drive_device
 smtpuser = args.smtpuser
@@ -302,47 +559,51 @@ smtppass = args.smtppass
 smtpport = args.smtpport
 smtpserver = args.smtpserver
 
-# If the debug or logging variables are
-# True, set and create the log directory
-# if it does not exist
-# --------------------------------------
+# If the debug or logging variables are True, make
+# sure any buffered log lines are written at exit.
+# The log directory and file are created by
+# flush_log() the first time it has lines to write
+# ------------------------------------------------
 if debug or logging:
-    date_stamp = now()
-    log_dir = os.path.dirname(log_file)
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
+    atexit.register(flush_log)
+else:
+    # Nothing will be logged, so replace log() with a no-op
+    # and skip the formatting and buffering on every call
+    # ----------------------------------------------------
+    def log(*args, **kwargs):
+        'Logging is disabled, do nothing.'
 
 # Log some startup information
 # ----------------------------
-log('Starting ' + progname + ' v' + version)
-log('Drive Device: ' + drive_device)
+log('Starting %s v%s', progname, version)
+log('Drive Device: %s', drive_device)
 
 # Do minor email validation and set the do_email
 # variable to True if we have what looks like an email
 # ----------------------------------------------------
 if email != None and '@' not in email:
-    log('email address \'' + email + '\' does not look like a valid email, will not attempt to send')
+    log('email address \'%s\' does not look like a valid email, will not attempt to send', email)
 elif email != None:
-    log('email is set to \'' + email + '\', will attempt to send')
+    log('email is set to \'%s\', will attempt to send', email)
     do_email = True
 
 if test:
     log('The \'test\' variable is True. Testing mode enabled!')
-    tapealerts_txt = re.findall(r'(TapeAlert\[\d+\]): +(.*)', fake_tapeinfo_txt)
+    tapealerts_txt = parse_tapealerts(fake_tapeinfo_txt)
     sg = 'These test mode results are bogus'
 else:
-    # Verify all binaries exist in path and are executable
-    # ----------------------------------------------------
-    log('Checking that system utilities exist: ' + ', '.join(cmd_lst))
-    for cmd in cmd_lst:
-        bin = cmd_exists(cmd)
-        if not bin:
-            log('Exiting with return code 0')
-            sys.exit(0)
-
-    # Get the OS uname
-    # ----------------
-    uname = get_uname()
+    # Get the OS uname once and pick the
+    # matching sg node lookup function
+    # ----------------------------------
+    uname = os.uname().sysname
+    log('OS uname: %s', uname)
+    if uname == 'Linux':
+        get_sg_node = get_sg_node_linux
+    elif uname == 'FreeBSD':
+        get_sg_node = get_sg_node_freebsd
+    else:
+        log('Unsupported OS \'%s\', failed to identify an sg node device for drive device %s', uname, drive_device)
+        exit_script()
 
     # Get the /dev/sg# node to check with tapeinfo
     # --------------------------------------------
@@ -357,9 +618,10 @@ else:
 # Parse and print any TapeAlerts found
 # ------------------------------------
 if len(tapealerts_txt) > 0:
-    msg = ''
-    warn_txt = '(' + str(len(tapealerts_txt)) + ') TapeAlert' + ('s' if len(tapealerts_txt) > 1 else '')
-    log('WARN: ' + warn_txt + ' detected on drive device:')
+    stdout_lst = []
+    msg_lst = []
+    warn_txt = f"({len(tapealerts_txt)}) TapeAlert{'s' if len(tapealerts_txt) > 1 else ''}"
+    log('WARN: %s detected on drive device:', warn_txt)
     for alert in tapealerts_txt:
         # The TapeAlert line(s) need to be printed to stdout for the SD to
         # recognize and act on.
@@ -378,17 +640,18 @@ if len(tapealerts_txt) > 0:
         # rest of the TapeAlert line:
         # [13]: Snapped Tape: The data cartridge contains a broken tape.
         # -----------------------------------------------------------------------
-        print(alert[0])
-        log('      ' + alert[0].replace('TapeAlert', '') + ': ' + alert[1])
-        msg += alert[0] + ': ' + alert[1] + '\n'
+        stdout_lst.append(f'{alert[0]}\n')
+        log('      %s: %s', alert[0].replace('TapeAlert', ''), alert[1])
+        msg_lst.append(f'{alert[0]}: {alert[1]}\n')
+    sys.stdout.write(''.join(stdout_lst))
+    msg = ''.join(msg_lst)
     if do_email:
-        import smtplib
-        from socket import gaierror
-        subject = progname + ' - WARN: ' + warn_txt + ' detected ' + ('during jobid: ' + jobid  + ' ' if jobid != None else '') + 'on device \'' + drive_device + '\''
-        msg_hdr = 'The following ' + warn_txt + (' were' if len(tapealerts_txt) > 1 else ' was') + ' detected:\n'
-        msg = msg_hdr + '-'*(len(msg_hdr) - 1) + '\n' + msg + '\n' + '-'*(len(prog_info_txt) - 2) + '\n' + prog_info_txt
+        jobid_txt = f'during jobid: {jobid} ' if jobid is not None else ''
+        subject = f"{progname} - WARN: {warn_txt} detected {jobid_txt}on device '{drive_device}'"
+        msg_hdr = f"The following {warn_txt} {'were' if len(tapealerts_txt) > 1 else 'was'} detected:\n"
+        msg = f"{msg_hdr}{'-'*(len(msg_hdr) - 1)}\n{msg}\n{prog_info_sep}\n{prog_info_txt}"
         send_email()
 else:
     log('No TapeAlerts found')
-log('-'*(len(prog_info_txt) - 2), ftr=True)
+log(prog_info_sep, ftr=True)
 log(prog_info_txt, ftr=True)